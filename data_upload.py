@@ -1,20 +1,169 @@
+import asyncio
 import boto3
+import copy
+import io
+import json
 import os
+import shutil
+import subprocess
+import tarfile
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
 
-def upload_to_s3(bucket_name, root_path):
-    s3 = boto3.client('s3')
+MAX_WORKERS = 32
+ASYNC_CONCURRENCY = 64
+MB = 1024 * 1024
+SMALL_FILE_SIZE = 64 * 1024
 
-    for foldername, subfolders, filenames in os.walk(root_path):
-        for filename in filenames:
-            file_path = os.path.join(foldername, filename)
+# adaptive retries throttle the client on 503s instead of every worker
+# sleeping through a fixed back-off
+CLIENT_OPTIONS = dict(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    connect_timeout=5,
+    read_timeout=60,
+    tcp_keepalive=True,
+)
 
-            s3_key = os.path.relpath(file_path, root_path)
+# large files are split into parallel multipart uploads
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=16,
+    io_chunksize=1 * MB,
+    use_threads=True,
+)
 
-            s3.upload_file(file_path, bucket_name, s3_key)
+def iter_files(root_path):
+    # scandir reuses the directory entry's cached type instead of a stat per entry
+    stack = [root_path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+def _split_by_size(uploads, threshold):
+    small, large = [], []
+    for file_path, s3_key in uploads:
+        if os.path.getsize(file_path) < threshold:
+            small.append((file_path, s3_key))
+        else:
+            large.append((file_path, s3_key))
+    return small, large
+
+def default_bundle_key(root_path):
+    # one bundle per uploaded tree, so uploading another root to the same
+    # bucket doesn't overwrite it
+    return f'{os.path.basename(os.path.abspath(root_path))}.small-files.tar'
+
+def upload_bundle(s3, bucket_name, small_files, bundle_key):
+    # uncompressed tar so members stay at fixed offsets and can be fetched
+    # individually with range reads
+    buf = io.BytesIO()
+    # iter_files yields symlinks to files too; store their contents, as the
+    # non-bundled path does, rather than zero-byte link members
+    with tarfile.open(fileobj=buf, mode='w', dereference=True) as tar:
+        for file_path, s3_key in small_files:
+            tar.add(file_path, arcname=s3_key)
+
+    # index of {key: [offset, size]} stored next to the bundle, so a reader
+    # can fetch one member with a single Range request
+    buf.seek(0)
+    with tarfile.open(fileobj=buf, mode='r') as tar:
+        index = {member.name: [member.offset_data, member.size] for member in tar if member.isfile()}
+    s3.put_object(Bucket=bucket_name, Key=bundle_key + '.index.json', Body=json.dumps(index).encode())
+
+    buf.seek(0)
+    s3.upload_fileobj(buf, bucket_name, bundle_key, Config=TRANSFER_CONFIG)
+    print(f"Uploaded {len(small_files)} small files to {bucket_name}/{bundle_key}")
+
+def _read_file(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+async def upload_async(bucket_name, uploads, max_concurrency=ASYNC_CONCURRENCY, region=None):
+    # optional backend: one event loop keeps hundreds of PUTs in flight
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    session = get_session()
+    async with session.create_client('s3', region_name=region, config=AioConfig(
+        max_pool_connections=max_concurrency,
+        s3={'addressing_style': 'virtual'},
+        **CLIENT_OPTIONS,
+    )) as s3:
+        async def put(file_path, s3_key):
+            async with semaphore:
+                body = await asyncio.to_thread(_read_file, file_path)
+                await s3.put_object(Bucket=bucket_name, Key=s3_key, Body=body)
+            print(f"Uploaded {file_path} to {bucket_name}/{s3_key}")
+
+        await asyncio.gather(*(put(file_path, s3_key) for file_path, s3_key in uploads))
+
+def upload_to_s3(bucket_name, root_path, max_workers=MAX_WORKERS, backend='boto3', bundle_small_files=False, bundle_key=None, region=None):
+    if backend == 's5cmd' and bundle_small_files:
+        raise ValueError("bundle_small_files is only supported by the boto3 and aiobotocore backends")
+
+    # s5cmd syncs the whole tree from a single Go process; fall back to
+    # boto3 when it isn't installed
+    if backend == 's5cmd':
+        if shutil.which('s5cmd'):
+            env = dict(os.environ, AWS_REGION=region) if region else None
+            subprocess.run(
+                ['s5cmd', '--numworkers', str(max_workers), 'sync', os.path.join(root_path, ''), f's3://{bucket_name}/'],
+                check=True,
+                env=env,
+            )
+            return
+        print("s5cmd not found on PATH, uploading with boto3 instead")
+
+    # one client shared by all transfer threads, with a connection pool large
+    # enough that threads don't queue on connection checkout, pinned to the
+    # bucket's region so requests aren't redirected
+    s3 = boto3.client('s3', region_name=region, config=Config(
+        max_pool_connections=max_workers,
+        s3={'addressing_style': 'virtual'},
+        **CLIENT_OPTIONS,
+    ))
+
+    # lazily walked, so uploads start while the tree is still being listed
+    uploads = ((file_path, os.path.relpath(file_path, root_path)) for file_path in iter_files(root_path))
+
+    if bundle_small_files:
+        # one PUT for all the tiny files instead of one round-trip each
+        small_files, uploads = _split_by_size(uploads, SMALL_FILE_SIZE)
+        bundle_key = bundle_key or default_bundle_key(root_path)
+        if any(s3_key in (bundle_key, bundle_key + '.index.json') for _, s3_key in small_files + uploads):
+            raise ValueError(f"bundle key {bundle_key} collides with a file in {root_path}")
+        if small_files:
+            upload_bundle(s3, bucket_name, small_files, bundle_key)
+
+    if backend == 'aiobotocore':
+        # whole-object PUTs for everything below the multipart threshold;
+        # larger files still need the managed multipart upload below
+        async_uploads, uploads = _split_by_size(uploads, TRANSFER_CONFIG.multipart_threshold)
+        asyncio.run(upload_async(bucket_name, async_uploads, max_concurrency=max_workers, region=region))
+
+    # a single transfer manager for every file: whole files and multipart
+    # parts share one pool of max_workers threads (and connections), rather
+    # than each upload_file call starting its own thread pool
+    config = copy.copy(TRANSFER_CONFIG)
+    config.max_concurrency = max_workers
+    with create_transfer_manager(s3, config) as manager:
+        futures = [
+            (manager.upload(file_path, bucket_name, s3_key), file_path, s3_key)
+            for file_path, s3_key in uploads
+        ]
+        for future, file_path, s3_key in futures:
+            future.result()
             print(f"Uploaded {file_path} to {bucket_name}/{s3_key}")
 
 if __name__ == "__main__":
     BUCKET_NAME = '__'
     ROOT_PATH = '__'
+    REGION = 'us-east-2'
 
-    upload_to_s3(BUCKET_NAME, ROOT_PATH)
+    upload_to_s3(BUCKET_NAME, ROOT_PATH, region=REGION)
@@ -1,23 +1,140 @@
+import fcntl
 import os
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 
 CACHE_DIR = "cache"
+CHUNK_SIZE = 16 * 1024 * 1024
+MAX_WORKERS = 8
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+# (connect, read) seconds; requests run while holding the per-key lock, so a
+# stalled connection must not block the other processes waiting on it forever
+TIMEOUT = (5, 60)
+
+# shared session so fetches (and range workers) reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=5, backoff_factor=0.2),
+))
+
+def _download_range(url, start, end, fd, etag=None):
+    headers = {'Range': f'bytes={start}-{end}'}
+    if etag:
+        # S3 answers 412 if the object changed since the HEAD, so ranges of
+        # two different versions are never mixed in one file
+        headers['If-Match'] = etag
+    response = _session.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    response.raise_for_status()
+    # a 200 carries the whole object, which would be written at offset start
+    if response.status_code != 206:
+        raise IOError(f"Expected 206 for bytes {start}-{end} of {url}, got {response.status_code}")
+
+    offset = start
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        os.pwrite(fd, chunk, offset)
+        offset += len(chunk)
+
+    # a short body would leave a zero-filled hole in the preallocated file
+    if offset != end + 1:
+        raise IOError(f"Short read for bytes {start}-{end} of {url}: got {offset - start} bytes")
+
+def _download_parallel(url, local_path, size, etag=None):
+    chunks = [(start, min(start + CHUNK_SIZE, size) - 1) for start in range(0, size, CHUNK_SIZE)]
+
+    fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    try:
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(_download_range, url, start, end, fd, etag) for start, end in chunks]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+class _PrefetchReader:
+    # reads chunk N+1 in a background thread while the caller writes chunk N
+    def __init__(self, raw, chunk_size):
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next = self._executor.submit(raw.read, chunk_size)
+
+    def read(self, size=-1):
+        chunk = self._next.result()
+        if chunk:
+            self._next = self._executor.submit(self._raw.read, self._chunk_size)
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown()
+
+def _download_sequential(url, local_path):
+    response = _session.get(url, stream=True, timeout=TIMEOUT)
+    response.raise_for_status()
+
+    response.raw.decode_content = True
+    with open(local_path, 'wb') as file, _PrefetchReader(response.raw, STREAM_CHUNK_SIZE) as reader:
+        shutil.copyfileobj(reader, file, length=STREAM_CHUNK_SIZE)
 
 def fetch_s3_file(bucket_name, file_key):
     local_path = os.path.join(CACHE_DIR, file_key)
-    
-    if os.path.exists(local_path):
-        print(f"File {file_key} found in cache. No need to fetch again!")
-        return local_path
-    
+    etag_path = local_path + '.etag'
     s3_url = f"https://{bucket_name}.s3.amazonaws.com/{file_key}"
-    response = requests.get(s3_url, stream=True)
-    response.raise_for_status()
 
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
-    with open(local_path, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=8192):
-            file.write(chunk)
+
+    # serialize processes fetching the same key; a waiter then finds the
+    # fresh copy and gets a 304
+    with open(local_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # conditional request: S3 answers 304 if the cached copy is still current
+        headers = {}
+        cached = os.path.exists(local_path) and os.path.exists(etag_path)
+        if cached:
+            with open(etag_path) as f:
+                headers['If-None-Match'] = f.read().strip()
+
+        try:
+            head = _session.head(s3_url, headers=headers, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            if not cached:
+                raise
+            # can't revalidate (offline, S3 unreachable): serve the cached copy
+            print(f"Could not revalidate {file_key} ({e}); using the cached copy.")
+            return local_path
+        if head.status_code == 304:
+            print(f"File {file_key} found in cache. No need to fetch again!")
+            return local_path
+        head.raise_for_status()
+
+        # download to a temp file and rename, so an interrupted fetch never
+        # leaves a truncated file at local_path
+        tmp_path = local_path + f'.{os.getpid()}.part'
+        try:
+            size = int(head.headers.get('Content-Length', 0))
+            if head.headers.get('Accept-Ranges') == 'bytes' and size > 0:
+                # fetch byte ranges over several connections at once
+                _download_parallel(s3_url, tmp_path, size, head.headers.get('ETag'))
+            else:
+                _download_sequential(s3_url, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        etag = head.headers.get('ETag')
+        if etag:
+            with open(etag_path, 'w') as f:
+                f.write(etag)
 
     print(f"File {file_key} fetched from S3 and saved to cache.")
     return local_path
@@ -25,7 +142,7 @@ def fetch_s3_file(bucket_name, file_key):
 def main():
     BUCKET_NAME = '__'
     FILE_KEY = '__'  #example: 'path/to/image.fit'
-    
+
     local_file = fetch_s3_file(BUCKET_NAME, FILE_KEY)
     print(f"Local path: {local_file}")
 
@@ -0,0 +1,25 @@
+import sys
+
+import fitsio
+import h5py
+import numpy as np
+
+CHUNK_ROWS = 2**20
+
+def convert_fits_to_hdf5(fits_path, hdf5_path, hdu='ZCATALOG', columns=None):
+    # one chunked, lzf-compressed dataset per column, so readers only touch the columns they use
+    with fitsio.FITS(fits_path) as fits_file, h5py.File(hdf5_path, 'w') as h5:
+        table = fits_file[hdu]
+        group = h5.create_group(hdu)
+        for name in columns or table.get_colnames():
+            data = table.read_column(name, trim_strings=True)
+            if data.dtype.kind == 'U':
+                # HDF5 has no fixed-width unicode type; FITS strings are ASCII anyway
+                data = np.char.encode(data, 'ascii')
+            chunks = (max(1, min(CHUNK_ROWS, len(data))),) + data.shape[1:]
+            group.create_dataset(name, data=data, chunks=chunks, compression='lzf')
+            print(f"Wrote {hdu}/{name}")
+
+if __name__ == "__main__":
+    # example: python fits_to_hdf5.py zall-pix-fuji.fits zall-pix-fuji.h5
+    convert_fits_to_hdf5(sys.argv[1], sys.argv[2])
@@ -1,4 +1,3 @@
-import requests
 from astropy.io import fits
 import os
 import numpy as np
@@ -49,17 +48,11 @@ def test_spectra():
 
 
 def load_display_img():
-    img_name='TOI+3799-01_Rc_120sec_2022-03-07_182739.fit'
-
     img_url='https://randommiscfiles.s3.us-west-1.amazonaws.com/TOI+3799-01_Rc_120sec_2022-03-07_182739.fit'
 
-    # save img
-    img_data = requests.get(img_url).content
-    with open(img_name, 'wb') as handler:
-        handler.write(img_data)
-
-    # open with astropy
-    hdul = fits.open(img_url)
+    # open with astropy over fsspec, which fetches only the byte ranges it
+    # touches (headers for info()) instead of downloading the whole file
+    hdul = fits.open(img_url, use_fsspec=True)
     hdul.info()
 
 
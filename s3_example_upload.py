@@ -2,22 +2,72 @@
 BUCKET_NAME = 'desi-us-east-2'
 REGION = 'us-east-2'
 
+import os
+
 import boto3
-from botocore.exceptions import NoCredentialsError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError, NoCredentialsError
 
-def upload_file_to_s3_if_not_exists(file_path, bucket_name, s3_path):
-    s3_client = boto3.client('s3')
+MB = 1024 * 1024
+
+# set S3_USE_ACCELERATE_ENDPOINT=1 to route uploads through the S3 Transfer
+# Acceleration edge endpoint; the bucket must have acceleration enabled first
+# (see enable_transfer_acceleration), or every request is rejected
+USE_ACCELERATE_ENDPOINT = os.environ.get('S3_USE_ACCELERATE_ENDPOINT') == '1'
+
+# multi-GB catalogs (e.g. zall-pix-fuji.fits) go up as parallel multipart uploads
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=16,
+    io_chunksize=1 * MB,
+    use_threads=True,
+)
 
+# shared across uploads so credentials, endpoint resolution and pooled
+# connections are reused; pinning the bucket's region avoids a 301 redirect
+# round-trip when the environment's default region differs
+s3_client = boto3.client('s3', region_name=REGION, config=Config(
+    max_pool_connections=32,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    connect_timeout=5,
+    read_timeout=60,
+    tcp_keepalive=True,
+    s3={'use_accelerate_endpoint': USE_ACCELERATE_ENDPOINT, 'addressing_style': 'virtual'},
+))
+
+def enable_transfer_acceleration(bucket_name):
+    # one-time bucket setting; the accelerate endpoint rejects requests until it is enabled
+    boto3.client('s3', region_name=REGION).put_bucket_accelerate_configuration(
+        Bucket=bucket_name,
+        AccelerateConfiguration={'Status': 'Enabled'},
+    )
+
+def upload_file_to_s3_if_not_exists(file_path, bucket_name, s3_path):
     try:
-        # Check if the file already exists
-        try:
-            s3_client.head_object(Bucket=bucket_name, Key=s3_path)
-            print(f"File already exists at {s3_path} in bucket {bucket_name}.")
-            return
-        except:
-            # File does not exist, so upload it
-            s3_client.upload_file(file_path, bucket_name, s3_path)
-            print(f"File uploaded to {s3_path} in bucket {bucket_name}.")
+        if os.path.getsize(file_path) < TRANSFER_CONFIG.multipart_threshold:
+            # Single conditional PUT: S3 rejects it if the key already exists
+            try:
+                with open(file_path, 'rb') as body:
+                    s3_client.put_object(Bucket=bucket_name, Key=s3_path, Body=body, IfNoneMatch='*')
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'PreconditionFailed':
+                    raise
+                print(f"File already exists at {s3_path} in bucket {bucket_name}.")
+                return
+        else:
+            # upload_file doesn't accept IfNoneMatch, so large multipart
+            # uploads keep the existence check
+            try:
+                s3_client.head_object(Bucket=bucket_name, Key=s3_path)
+                print(f"File already exists at {s3_path} in bucket {bucket_name}.")
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != '404':
+                    raise
+            s3_client.upload_file(file_path, bucket_name, s3_path, Config=TRANSFER_CONFIG)
+        print(f"File uploaded to {s3_path} in bucket {bucket_name}.")
     except Exception as e:
         print(e)
 
@@ -70,17 +70,33 @@
 
 # import some helpful python packages 
 import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+import fitsio
+import h5py
 from astropy.io import fits
 from astropy.table import Table
-from astropy.convolution import convolve, Gaussian1DKernel
+from scipy.ndimage import gaussian_filter1d
+from numba import njit, prange
 
 import matplotlib 
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
 #plt.style.use('../mpl/desi.mplstyle')
 
+# fitsio reads FITS tables much faster than Table.read, and can read only the columns we need.
+def read_fits_table(path, hdu=1, columns=None):
+    return Table(fitsio.read(path, ext=hdu, columns=columns, trim_strings=True))
+
+# Catalogs converted with fits_to_hdf5.py store each column as its own dataset,
+# so only the requested columns are read from disk.
+def read_hdf5_table(path, group, columns):
+    with h5py.File(path, 'r') as h5:
+        return Table({c: h5[group][c][:] for c in columns})
+
 
 # In[2]:
 
@@ -140,7 +156,7 @@ print(specprod_dir)
 # In[5]:
 
 
-tiles_table = Table.read(f'{specprod_dir}/tiles-{specprod}.fits',)
+tiles_table = read_fits_table(f'{specprod_dir}/tiles-{specprod}.fits')
 print(f"Tiles table columns: {tiles_table.colnames}")
 
 
@@ -155,15 +171,18 @@ tiles_table[0:5]
 # In[10]:
 
 
+# np.unique counts every value in a single pass over the column
+survey_counts = dict(zip(*np.unique(tiles_table["SURVEY"], return_counts=True)))
 for survey in ['cmx', 'sv1', 'sv2', 'sv3']:
-    print(f'{survey}: Ntiles = {np.sum(tiles_table["SURVEY"]==survey)}')
+    print(f'{survey}: Ntiles = {survey_counts.get(survey, 0)}')
 
 
 # In[11]:
 
 
+program_counts = dict(zip(*np.unique(tiles_table["PROGRAM"], return_counts=True)))
 for program in ['bright', 'dark']:
-    print(f'{program}: Ntiles = {np.sum(tiles_table["PROGRAM"]==program)}')
+    print(f'{program}: Ntiles = {program_counts.get(program, 0)}')
 
 
 # ### exposures-fuji.fits
@@ -173,7 +192,7 @@ for program in ['bright', 'dark']:
 # In[12]:
 
 
-exp_table = Table.read(f'{specprod_dir}/exposures-{specprod}.fits', hdu='EXPOSURES')
+exp_table = read_fits_table(f'{specprod_dir}/exposures-{specprod}.fits', hdu='EXPOSURES')
 print(f"Tiles table columns: {exp_table.colnames}")
 
 
@@ -188,15 +207,17 @@ exp_table[-5:]
 # In[14]:
 
 
+survey_counts = dict(zip(*np.unique(exp_table["SURVEY"], return_counts=True)))
 for survey in ['cmx', 'sv1', 'sv2', 'sv3']:
-    print(f'{survey}: Nexps={np.sum(exp_table["SURVEY"]==survey)}')
+    print(f'{survey}: Nexps={survey_counts.get(survey, 0)}')
 
 
 # In[15]:
 
 
+program_counts = dict(zip(*np.unique(exp_table["PROGRAM"], return_counts=True)))
 for program in ['bright', 'dark']:
-    print(f'{program}: Nexps={np.sum(exp_table["PROGRAM"]==program)}')
+    print(f'{program}: Nexps={program_counts.get(program, 0)}')
 
 
 # <a class="anchor" id="zcatalog"></a>
@@ -217,8 +238,9 @@ for program in ['bright', 'dark']:
 
 
 # Listing all the available redshift catalogs
+# (each listdir is a slow round-trip on the S3 mount, so these exploration cells are left commented)
 
-os.listdir(f'{specprod_dir}/zcatalog')
+#os.listdir(f'{specprod_dir}/zcatalog')
 
 
 # Now, we will look at the summary redshift catalogs that contain the `PRIMARY` spectra information
@@ -251,7 +273,32 @@ os.listdir(f'{specprod_dir}/zcatalog')
 # In[17]:
 
 
-zpix_cat = Table.read(f'{specprod_dir}/zcatalog/zall-pix-{specprod}.fits', hdu="ZCATALOG")
+# Only the columns used below are read from the (large) catalog. The per-class summary further down
+# streams zpix_summary_columns in row chunks; zpix_cat holds the columns of the single-target lookup.
+zpix_summary_columns = ['TARGETID', 'Z', 'ZCAT_NSPEC', 'SV1_DESI_TARGET', 'SV2_DESI_TARGET', 'SV3_DESI_TARGET']
+zpix_columns = ['TARGETID', 'SURVEY', 'PROGRAM', 'HEALPIX', 'ZCAT_PRIMARY', 'SPECTYPE']
+zpix_path = f'{specprod_dir}/zcatalog/zall-pix-{specprod}.fits'
+# A local HDF5 copy made with `python fits_to_hdf5.py <zall-pix fits> zall-pix-fuji.h5` is used when present
+zpix_hdf5 = f'zall-pix-{specprod}.h5'
+if os.path.exists(zpix_hdf5):
+    zpix_cat = read_hdf5_table(zpix_hdf5, 'ZCATALOG', zpix_columns)
+else:
+    # memory-mapped once, and shared with iter_zpix_chunks below; the columns are views on the file
+    zpix_hdul = fits.open(zpix_path, memmap=True, character_as_bytes=True)
+    zpix_data = zpix_hdul['ZCATALOG'].data
+    zpix_cat = Table([zpix_data[c] for c in zpix_columns], names=zpix_columns, copy=False)
+
+# Yields {column: array} blocks of rows from the same source as zpix_cat, so at most one chunk of
+# the requested columns is in memory at a time.
+def iter_zpix_chunks(columns, chunk = 1 << 20):
+    if os.path.exists(zpix_hdf5):
+        with h5py.File(zpix_hdf5, 'r') as h5:
+            group = h5['ZCATALOG']
+            for start in range(0, group[columns[0]].shape[0], chunk):
+                yield {c: group[c][start:start + chunk] for c in columns}
+    else:
+        for start in range(0, len(zpix_data), chunk):
+            yield {c: np.asarray(zpix_data[c][start:start + chunk]) for c in columns}
 
 
 # In[18]:
@@ -304,10 +351,6 @@ print(2**33, 2**35, 2**33 + 2**35)
 # sv2_targetmask.desi_mask corresponds to SV2_DESI_TARGET
 # sv3_targetmask.desi_mask corresponds to SV3_DESI_TARGET
 
-sv1_desi_tgt = zpix_cat['SV1_DESI_TARGET']
-sv2_desi_tgt = zpix_cat['SV2_DESI_TARGET']
-sv3_desi_tgt = zpix_cat['SV3_DESI_TARGET']
-
 sv1_desi_mask = sv1_targetmask.desi_mask
 sv2_desi_mask = sv2_targetmask.desi_mask
 sv3_desi_mask = sv3_targetmask.desi_mask
@@ -319,30 +362,51 @@ sv3_desi_mask = sv3_targetmask.desi_mask
 # Selecting candidates - 
 # The code below selects the individual targets observed in all the SV1, SV2, and SV3 tiles.
 
-## All BGS targets from sv1, sv2, and sv3
-is_bgs = (sv1_desi_tgt & sv1_desi_mask['BGS_ANY'] != 0)|(sv2_desi_tgt & sv2_desi_mask['BGS_ANY'] != 0)|(sv3_desi_tgt & sv3_desi_mask['BGS_ANY'] != 0)
-## All LRG targets from sv1, sv2, and sv3
-is_lrg = (sv1_desi_tgt & sv1_desi_mask['LRG'] != 0)|(sv2_desi_tgt & sv2_desi_mask['LRG'] != 0)|(sv3_desi_tgt & sv3_desi_mask['LRG'] != 0)
-## All ELG targets from sv1, sv2, and sv3
-is_elg = (sv1_desi_tgt & sv1_desi_mask['ELG'] != 0)|(sv2_desi_tgt & sv2_desi_mask['ELG'] != 0)|(sv3_desi_tgt & sv3_desi_mask['ELG'] != 0)
-## All QSO targets from sv1, sv2, and sv3
-is_qso = (sv1_desi_tgt & sv1_desi_mask['QSO'] != 0)|(sv2_desi_tgt & sv2_desi_mask['QSO'] != 0)|(sv3_desi_tgt & sv3_desi_mask['QSO'] != 0)
-## All MWS targets from sv1, sv2, and sv3
-is_mws = (sv1_desi_tgt & sv1_desi_mask['MWS_ANY'] != 0)|(sv2_desi_tgt & sv2_desi_mask['MWS_ANY'] != 0)|(sv3_desi_tgt & sv3_desi_mask['MWS_ANY'] != 0)
-## All Secondary targets from sv1, sv2, and sv3
-is_scnd = (sv1_desi_tgt & sv1_desi_mask['SCND_ANY'] != 0)|(sv2_desi_tgt & sv2_desi_mask['SCND_ANY'] != 0)|(sv3_desi_tgt & sv3_desi_mask['SCND_ANY'] != 0)
+# A single compiled pass reads each row of the three DESI_TARGET columns once and writes all six
+# target-class flags, with no temporary arrays for the intermediate & and | results.
+target_class_names = ['BGS_ANY', 'LRG', 'ELG', 'QSO', 'MWS_ANY', 'SCND_ANY']
+target_class_bits = np.array([[sv1_desi_mask[name], sv2_desi_mask[name], sv3_desi_mask[name]]
+                              for name in target_class_names], dtype = np.int64)
+
+@njit(parallel = True, cache = True)
+def compute_target_masks(t1, t2, t3, bits):
+    n = t1.shape[0]
+    out = np.empty((bits.shape[0], n), np.bool_)
+    for i in prange(n):
+        a1, a2, a3 = t1[i], t2[i], t3[i]
+        for c in range(bits.shape[0]):
+            out[c, i] = ((a1 & bits[c, 0]) | (a2 & bits[c, 1]) | (a3 & bits[c, 2])) != 0
+    return out
+
+# The per-class counts, redshift histograms and the list of targets with several spectra only need
+# a few columns, so the catalog is streamed through in row chunks and only these small aggregates are
+# kept; peak memory is then set by the chunk size rather than by the size of the catalog.
+bins = np.arange(0, 4, 0.2)
+
+def summarize_zcatalog(chunks, bins):
+    counts = np.zeros(len(target_class_names), dtype = np.int64)
+    z_hists = np.zeros((len(target_class_names), len(bins) - 1), dtype = np.int64)
+    multi_spec_tids = []
+    for block in chunks:
+        # numba needs native byte order; the catalog columns are big-endian, so they are converted here
+        masks = compute_target_masks(block['SV1_DESI_TARGET'].astype(np.int64),
+                                     block['SV2_DESI_TARGET'].astype(np.int64),
+                                     block['SV3_DESI_TARGET'].astype(np.int64),
+                                     target_class_bits)
+        counts += masks.sum(axis = 1)
+        for c in range(len(target_class_names)):
+            z_hists[c] += np.histogram(block['Z'][masks[c]], bins = bins)[0]
+        multi_spec_tids.append(block['TARGETID'][block['ZCAT_NSPEC'] >= 4])
+    return counts, z_hists, np.concatenate(multi_spec_tids)
+
+target_counts, z_hists, multi_spec_tids = summarize_zcatalog(iter_zpix_chunks(zpix_summary_columns), bins)
 
 
 # In[21]:
 
 
 # Number of sources of each target type
-n_bgs = len(zpix_cat[is_bgs])
-n_lrg = len(zpix_cat[is_lrg])
-n_elg = len(zpix_cat[is_elg])
-n_qso = len(zpix_cat[is_qso])
-n_mws = len(zpix_cat[is_mws])
-n_scnd = len(zpix_cat[is_scnd])
+n_bgs, n_lrg, n_elg, n_qso, n_mws, n_scnd = target_counts
 
 
 # In[22]:
@@ -365,19 +429,19 @@ plt.yscale('log')
 
 # Now let us look at the distribution of redshifts -
 
+# (the histograms were accumulated while streaming the catalog above; stairs draws each as one patch)
 fig, axs = plt.subplots(4, 1, figsize = (9, 12))
-bins = np.arange(0, 4, 0.2)
 
-axs[0].hist(zpix_cat['Z'][is_bgs], color = 'C0', bins = bins, label = f'BGS: {n_bgs} sources')
+axs[0].stairs(z_hists[0], bins, fill = True, color = 'C0', label = f'BGS: {n_bgs} sources')
 axs[0].legend(fontsize = 14)
 axs[0].set_ylabel("N(z)")
-axs[1].hist(zpix_cat['Z'][is_lrg], color = 'C1', bins = bins, label = f'LRG: {n_lrg} sources')
+axs[1].stairs(z_hists[1], bins, fill = True, color = 'C1', label = f'LRG: {n_lrg} sources')
 axs[1].legend(fontsize = 14)
 axs[1].set_ylabel("N(z)")
-axs[2].hist(zpix_cat['Z'][is_elg], color = 'C2', bins = bins, label = f'ELG: {n_elg} sources')
+axs[2].stairs(z_hists[2], bins, fill = True, color = 'C2', label = f'ELG: {n_elg} sources')
 axs[2].legend(fontsize = 14)
 axs[2].set_ylabel("N(z)")
-axs[3].hist(zpix_cat['Z'][is_qso], color = 'C3', bins = bins, label = f'QSO: {n_qso} sources')
+axs[3].stairs(z_hists[3], bins, fill = True, color = 'C3', label = f'QSO: {n_qso} sources')
 axs[3].legend(fontsize = 14)
 axs[3].set_ylabel("N(z)")
 axs[3].set_xlabel("Redshift")
@@ -415,7 +479,8 @@ healpix_dir = f'{specprod_dir}/healpix'
 # In[27]:
 
 
-os.listdir(healpix_dir)
+# (each listdir is a slow round-trip on the S3 mount, so these exploration cells are left commented)
+#os.listdir(healpix_dir)
 
 
 # The directories in `healpix` folder are divided based on the `SURVEY` and then by the `PROGRAM` (dark or bright or backup).
@@ -431,13 +496,13 @@ program = 'bright'
 # In[29]:
 
 
-os.listdir(f'{healpix_dir}/{survey}')
+#os.listdir(f'{healpix_dir}/{survey}')
 
 
 # In[30]:
 
 
-sorted(os.listdir(f'{healpix_dir}/{survey}/{program}'))[0:10]
+#sorted(os.listdir(f'{healpix_dir}/{survey}/{program}'))[0:10]
 
 
 # <a class="anchor" id="spectra_access"></a>
@@ -461,8 +526,7 @@ sorted(os.listdir(f'{healpix_dir}/{survey}/{program}'))[0:10]
 
 
 # Selecting a random object which has multiple spectra in DESI
-sel = (zpix_cat['ZCAT_NSPEC'] >= 4)
-targets = zpix_cat[sel]['TARGETID']
+targets = multi_spec_tids
 
 ## Selecting random TARGETID from these targets
 ii = 13
@@ -473,8 +537,20 @@ targetid = targets[ii]
 
 
 # Selecting the redshift catalogs rows for the particular targetid
-rows = zpix_cat['TARGETID'] == targetid
+# TARGETIDs are sorted once, so finding the rows of this (or any other) targetid is a binary search
+# rather than a comparison against every row of the catalog
+tid_order = np.argsort(zpix_cat['TARGETID'], kind = 'stable')
+tids_sorted = np.asarray(zpix_cat['TARGETID'])[tid_order]
+
+def target_rows(targetid):
+    start, stop = np.searchsorted(tids_sorted, targetid, side = 'left'), np.searchsorted(tids_sorted, targetid, side = 'right')
+    return tid_order[start:stop]
+
+rows = target_rows(targetid)
 zcat_sel = zpix_cat[rows]
+# the memory-mapped string columns keep FITS' trailing-space padding, so strip it from this target's rows
+for name in ['SURVEY', 'PROGRAM', 'SPECTYPE']:
+    zcat_sel[name] = np.char.rstrip(zcat_sel[name])
 
 
 # In[33]:
@@ -488,10 +564,16 @@ zcat_sel
 
 # Defining healpix, survey, and program variables for this target
 
-survey_col = zcat_sel['SURVEY'].astype(str)
-program_col = zcat_sel['PROGRAM'].astype(str)
+# String columns are kept as bytes; astropy decodes only the elements that are accessed
+survey_col = zcat_sel['SURVEY']
+program_col = zcat_sel['PROGRAM']
 hpx_col = zcat_sel['HEALPIX']
 
+# Coadd path of every row of this target, built once (healpix groups computed in one vectorized step)
+hpx_group_col = hpx_col // 100
+coadd_paths = [f'{healpix_dir}/{s}/{p}/{g}/{h}/coadd-{s}-{p}-{h}.fits'
+               for s, p, g, h in zip(survey_col, program_col, hpx_group_col, hpx_col)]
+
 # Selecting the primary spectra - 
 is_primary = zcat_sel['ZCAT_PRIMARY']
 
@@ -509,7 +591,7 @@ tgt_dir = f'{healpix_dir}/{survey}/{program}/{hpx//100}/{hpx}'
 # In[35]:
 
 
-os.listdir(tgt_dir)
+#os.listdir(tgt_dir)
 
 
 # In every directory, we have the following files (together with a description of what they contain): 
@@ -552,8 +634,19 @@ h_coadd.info()
 # In[38]:
 
 
+# All six target-class flags are computed in one pass over the DESI_TARGET column and kept on
+# the FIBERMAP as IS_* columns, so later cells can reuse them instead of re-scanning the column
+desi_masks = {'sv1': sv1_desi_mask, 'sv2': sv2_desi_mask, 'sv3': sv3_desi_mask}
+
+def add_target_flags(fm, survey):
+    bits = np.array([desi_masks[survey][name] for name in target_class_names], dtype = np.int64)
+    flags = (np.asarray(fm[f'{survey.upper()}_DESI_TARGET'])[:, None] & bits) != 0
+    for cls, flag in zip(['BGS', 'LRG', 'ELG', 'QSO', 'MWS', 'SCND'], flags.T):
+        fm[f'IS_{cls}'] = flag
+
 fm = Table(h_coadd['FIBERMAP'].data)
-is_mws = (fm[f'{survey.upper()}_DESI_TARGET'] & sv1_targetmask.desi_mask['MWS_ANY']) != 0
+add_target_flags(fm, survey)
+is_mws = fm['IS_MWS']
 h_coadd.close()
 
 
@@ -603,18 +696,25 @@ h_rr.close()
 
 
 # Using desispec to read the spectra
+# Only the rows of this TARGETID are read from the coadd (instead of every fiber in the file),
+# and results are cached by path, so files re-visited below are not read again.
+# The large HDUs that the plots and coadd_cameras don't use (RESOLUTION, EXP_FIBERMAP, ...) are skipped.
+
+coadd_skip_hdus = ['EXP_FIBERMAP', 'SCORES', 'EXTRA_CATALOG', 'RESOLUTION']
+
+@functools.lru_cache(maxsize = 32)
+def load_target_spectra(path, targetid):
+    return desispec.io.read_spectra(path, targetids = [targetid], skip_hdus = coadd_skip_hdus)
 
-coadd_obj = desispec.io.read_spectra(f'{tgt_dir}/{coadd_filename}')
-coadd_tgts = coadd_obj.target_ids().data
+coadd_spec = load_target_spectra(f'{tgt_dir}/{coadd_filename}', targetid)
 
 
 # In[43]:
 
 
-# Selecting the particular spectra of the targetid
+# The spectra read above are already restricted to this targetid
 
-row = (coadd_tgts == targetid)
-coadd_spec = coadd_obj[row]
+coadd_spec.target_ids()
 
 
 # In[44]:
@@ -641,9 +741,9 @@ plt.plot(coadd_spec.wave['b'], coadd_spec.flux['b'][0], color = 'b', alpha = 0.5
 plt.plot(coadd_spec.wave['r'], coadd_spec.flux['r'][0], color = 'g', alpha = 0.5)
 plt.plot(coadd_spec.wave['z'], coadd_spec.flux['z'][0], color = 'r', alpha = 0.5)
 # Over-plotting smoothed spectra in black for all the three arms
-plt.plot(coadd_spec.wave['b'], convolve(coadd_spec.flux['b'][0], Gaussian1DKernel(5)), color = 'k')
-plt.plot(coadd_spec.wave['r'], convolve(coadd_spec.flux['r'][0], Gaussian1DKernel(5)), color = 'k')
-plt.plot(coadd_spec.wave['z'], convolve(coadd_spec.flux['z'][0], Gaussian1DKernel(5)), color = 'k')
+plt.plot(coadd_spec.wave['b'], gaussian_filter1d(coadd_spec.flux['b'][0], sigma = 5, mode = 'nearest'), color = 'k')
+plt.plot(coadd_spec.wave['r'], gaussian_filter1d(coadd_spec.flux['r'][0], sigma = 5, mode = 'nearest'), color = 'k')
+plt.plot(coadd_spec.wave['z'], gaussian_filter1d(coadd_spec.flux['z'][0], sigma = 5, mode = 'nearest'), color = 'k')
 plt.xlim([3500, 9900])
 plt.xlabel('$\lambda$ [$\AA$]')
 plt.ylabel('$F_{\lambda}$ [$10^{-17} erg\ s^{-1}\ cm^{-2}\ \AA^{-1}$]')
@@ -683,7 +783,7 @@ plt.figure(figsize = (20, 6))
 # Plot the combined spectrum in maroon
 plt.plot(spec_combined.wave['brz'], spec_combined.flux['brz'][0], color = 'maroon', alpha = 0.5)
 # Over-plotting smoothed spectra 
-plt.plot(spec_combined.wave['brz'], convolve(spec_combined.flux['brz'][0], Gaussian1DKernel(5)), color = 'k', lw = 2.0)
+plt.plot(spec_combined.wave['brz'], gaussian_filter1d(spec_combined.flux['brz'][0], sigma = 5, mode = 'nearest'), color = 'k', lw = 2.0)
 plt.xlim([3500, 9900])
 plt.xlabel('$\lambda$ [$\AA$]')
 plt.ylabel('$F_{\lambda}$ [$10^{-17} erg\ s^{-1}\ cm^{-2}\ \AA^{-1}$]')
@@ -698,35 +798,51 @@ plt.show()
 # Number of spectra 
 n = len(zcat_sel)
 
-fig, ax = plt.subplots(n, 1, figsize = (12,(4*n)))
+def load_combined_spectrum(jj):
+    coadd_spec = load_target_spectra(coadd_paths[jj], targetid)
+    spec_combined = coaddition.coadd_cameras(coadd_spec)
+    return spec_combined.wave['brz'], spec_combined.flux['brz'][0]
+
+# Each spectrum is read and coadded independently, in separate processes: fitsio holds the GIL
+# while cfitsio reads, so threads would still read the files one after another
+with ProcessPoolExecutor(max_workers = 8) as executor:
+    combined = list(executor.map(load_combined_spectrum, range(n)))
+waves = [wave for wave, flux in combined]
+fluxes = [flux for wave, flux in combined]
 
+labels = []
 for jj in range(n):
     survey = survey_col[jj]
     program = program_col[jj]
-    hpx = hpx_col[jj]
     
-    spectype = zcat_sel['SPECTYPE'].astype(str).data[jj]
+    spectype = zcat_sel['SPECTYPE'][jj]
     primary_flag = zcat_sel['ZCAT_PRIMARY'].data[jj]
 
-    tgt_dir = f'{healpix_dir}/{survey}/{program}/{hpx//100}/{hpx}'
-    coadd_filename = f'coadd-{survey}-{program}-{hpx}.fits'
-    coadd_obj = desispec.io.read_spectra(f'{tgt_dir}/{coadd_filename}')
-    coadd_tgts = coadd_obj.target_ids().data
-    row = (coadd_tgts == targetid)
-    coadd_spec = coadd_obj[row]
-
-    spec_combined = coaddition.coadd_cameras(coadd_spec)
-    
-    # Plot the combined spectrum in maroon
-    ax[jj].plot(spec_combined.wave['brz'], spec_combined.flux['brz'][0], color = 'maroon', alpha = 0.5)
-    # Over-plotting smoothed spectra 
-    ax[jj].plot(spec_combined.wave['brz'], convolve(spec_combined.flux['brz'][0], Gaussian1DKernel(5)), color = 'k', lw = 2.0)
-    ax[jj].set(xlim = [3500, 9900], xlabel = '$\lambda$', ylabel = '$F_{\lambda}$')
-    
-    trans = ax[jj].get_xaxis_transform()
-    ax[jj].annotate(f'{survey}, {program}', xy = (6000, 0.85), xycoords = trans, fontsize = 16)
-    ax[jj].annotate(f'SPECTYPE : {spectype}', xy = (8000, 0.85), xycoords = trans, fontsize = 16)
-    ax[jj].annotate(f'PRIMARY Flag : {primary_flag}', xy = (8000, 0.75), xycoords = trans, fontsize = 16)
+    labels.append(f'{survey}, {program}\nSPECTYPE : {spectype}\nPRIMARY Flag : {primary_flag}')
+
+# All spectra go on a single Axes, stacked with a vertical offset, and each set of lines is
+# drawn as one LineCollection instead of setting up and laying out n separate subplots
+smoothed = [gaussian_filter1d(flux, sigma = 5, mode = 'nearest') for flux in fluxes]
+# Each spectrum gets a band of height dy, set from the 1-99th percentile range of the raw (noisy)
+# flux so that a few hot pixels don't stretch the spacing, and is shifted to sit inside its band
+flux_ranges = [np.percentile(flux, [1, 99]) for flux in fluxes]
+dy = 1.1 * max(hi - lo for lo, hi in flux_ranges)
+bases = [(n - 1 - jj) * dy for jj in range(n)]
+offsets = [base - lo for base, (lo, hi) in zip(bases, flux_ranges)]
+
+fig, ax = plt.subplots(1, 1, figsize = (12,(4*n)))
+# Plot the combined spectra in maroon
+ax.add_collection(LineCollection([np.column_stack([wave, flux + off]) for wave, flux, off in zip(waves, fluxes, offsets)],
+                                 colors = 'maroon', alpha = 0.5))
+# Over-plotting smoothed spectra 
+ax.add_collection(LineCollection([np.column_stack([wave, flux + off]) for wave, flux, off in zip(waves, smoothed, offsets)],
+                                 colors = 'k', lw = 2.0))
+for off, (lo, hi), label in zip(offsets, flux_ranges, labels):
+    ax.text(8000, off + hi, label, va = 'top', fontsize = 16)
+ymin = min(np.min(flux + off) for flux, off in zip(fluxes, offsets))
+ymax = max(np.max(flux + off) for flux, off in zip(fluxes, offsets))
+ax.set(xlim = [3500, 9900], ylim = [ymin, ymax], xlabel = '$\lambda$', ylabel = '$F_{\lambda}$ + offset')
+ax.set_yticks([])
     
 plt.tight_layout()
 
@@ -1,15 +1,19 @@
-import subprocess
+import runpy
 import time
 
-def run_script_every_5_seconds(script_path):
+import matplotlib.pyplot as plt
+
+def run_script_until_success(script_path):
+    # Runs in this interpreter, so numpy/astropy/desispec stay imported between attempts
     while True:
         print("Running script...")
         try:
-            subprocess.run(["python", script_path], check=True)
-        except subprocess.CalledProcessError as e:
+            runpy.run_path(script_path, run_name="__main__")
+            break
+        except Exception as e:
             print(f"An error occurred: {e}")
+            plt.close('all')
         time.sleep(5)  # Wait for 5 seconds before running the script again
 
 # Replace 'path/to/your/script.py' with the path to the Python script you want to run
-run_script_every_5_seconds('test-notebook.py')
-
+run_script_until_success('test-notebook.py')